@@ -1,9 +1,61 @@
 # File: agents/action_agent.py
 import logging
-from typing import Dict, Any
+import re
+from typing import Callable, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Guardrail keywords per action type, as (keywords, log reason, user-facing message) groups.
+ACTION_GUARDRAILS = {
+    "web_search": [
+        (frozenset({"illegal drugs", "violent acts", "child exploitation", "harmful chemicals"}),
+         "Illegal content search detected.",
+         "Cannot perform web search for harmful or illegal content."),
+        (frozenset({"delete", "format"}),
+         "Potentially destructive search query.",
+         "Cannot perform web search for potentially destructive actions."),
+    ],
+    "save_data": [
+        (frozenset({"credit card numbers", "ssn", "passwords of others"}),
+         "Attempt to save sensitive data.",
+         "Cannot save highly sensitive personal information."),
+    ],
+    "schedule_meeting": [
+        (frozenset({"bomb threat", "illegal gathering"}),
+         "Attempt to schedule illegal activity.",
+         "Cannot schedule meetings related to illegal activities."),
+    ],
+}
+
+# Prefixes of the action line shown in the UI (see decide_and_execute).
+ACTION_PREFIX = "[ACTION]: "
+ACTION_BLOCKED_PREFIX = "[ACTION BLOCKED]: "
+
+# Action types that may be executed; anything else is blocked by validate_action.
+ALLOWED_ACTIONS = frozenset({"none", "web_search", "save_data", "schedule_meeting"})
+
+# Trigger phrases used by determine_action, tagged with the action they point to.
+ACTION_TRIGGERS = {
+    "search the web for": "web_search",
+    "save this information": "save_data",
+    "schedule": "schedule",
+    "meeting": "meeting",
+}
+
+def _compile_keywords(tagged_keywords: Dict[str, Any], whole_words: bool = False) -> Tuple[re.Pattern, Dict[str, Any]]:
+    """
+    Compiles {keyword: tag} into one case-insensitive alternation, longest first (ties sorted for a stable pattern).
+    With `whole_words`, keywords only match as whole words ("format" does not match "information").
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    Each keyword is its own named group, and the returned dict maps group names to tags: look up
+    `match.lastgroup`, not the matched text, which can differ from the keyword under Unicode
+    case folding (e.g., "ſ" matches "s").
+    """
+    ordered = sorted(tagged_keywords, key=lambda keyword: (-len(keyword), keyword))
+    pattern = "|".join(f"(?P<k{i}>{re.escape(keyword)})" for i, keyword in enumerate(ordered))
+    if whole_words:
+        pattern = rf"\b(?:{pattern})\b"
+    return re.compile(pattern, re.IGNORECASE), {f"k{i}": tagged_keywords[keyword] for i, keyword in enumerate(ordered)}
 
 class ActionAgent:
     """
@@ -11,11 +63,20 @@ class ActionAgent:
     This includes guardrails to prevent illegal actions.
     """
     def __init__(self):
-        logging.info("ActionAgent initialized.")
+        # One pattern per action type so each validation is a single pass over the details.
+        self._guardrail_patterns = {}
+        for action_type, groups in ACTION_GUARDRAILS.items():
+            tags = {}
+            for keywords, reason, message in groups:
+                for keyword in keywords:
+                    tags.setdefault(keyword.lower(), (reason, message))
+            self._guardrail_patterns[action_type] = _compile_keywords(tags, whole_words=True)
+        self._trigger_pattern, self._trigger_tags = _compile_keywords(ACTION_TRIGGERS)
+        logger.info("ActionAgent initialized.")
 
     def _log_blocked_action(self, action_type: str, details: Any, reason: str):
         """Logs details of blocked actions."""
-        logging.error(f"ACTION BLOCKED - Type: {action_type}, Reason: {reason}, Details: {details}")
+        logger.error("ACTION BLOCKED - Type: %s, Reason: %s, Details: %s", action_type, reason, details)
         # In a real system, this would trigger alerts or more severe logging.
 
     def validate_action(self, action_data: Dict[str, Any]) -> (bool, str):
@@ -31,28 +92,18 @@ class ActionAgent:
         action_type = action_data.get("action")
         details = action_data.get("query") or action_data.get("data") or action_data.get("details")
 
-        # --- Action-Specific Guardrails (Examples - customize based on your needs) ---
-        if action_type == "web_search":
-            if details and any(keyword in details.lower() for keyword in ["illegal drugs", "violent acts", "child exploitation", "harmful chemicals"]):
-                self._log_blocked_action(action_type, details, "Illegal content search detected.")
-                return False, "Cannot perform web search for harmful or illegal content."
-            if "delete" in details.lower() or "format" in details.lower():
-                 self._log_blocked_action(action_type, details, "Potentially destructive search query.")
-                 return False, "Cannot perform web search for potentially destructive actions."
-
-        elif action_type == "save_data":
-            if details and any(keyword in details.lower() for keyword in ["credit card numbers", "ssn", "passwords of others"]):
-                self._log_blocked_action(action_type, details, "Attempt to save sensitive data.")
-                return False, "Cannot save highly sensitive personal information."
-            # Add more checks, e.g., if data is too large, or attempts to overwrite critical system files
-            
-        elif action_type == "schedule_meeting":
-            if details and any(keyword in details.lower() for keyword in ["bomb threat", "illegal gathering"]):
-                self._log_blocked_action(action_type, details, "Attempt to schedule illegal activity.")
-                return False, "Cannot schedule meetings related to illegal activities."
+        # --- Action-Specific Guardrails (see ACTION_GUARDRAILS to customize) ---
+        guardrail = self._guardrail_patterns.get(action_type)
+        if guardrail and details:
+            pattern, tags = guardrail
+            match = pattern.search(details)
+            if match:
+                reason, message = tags[match.lastgroup]
+                self._log_blocked_action(action_type, details, reason)
+                return False, message
 
         # Prevent any unknown or potentially dangerous actions
-        if action_type not in ["none", "web_search", "save_data", "schedule_meeting"]:
+        if action_type not in ALLOWED_ACTIONS:
             self._log_blocked_action(action_type, details, "Attempted unknown or unauthorized action type.")
             return False, f"Unsupported or unauthorized action: '{action_type}'."
 
@@ -70,24 +121,30 @@ class ActionAgent:
             Dict[str, Any]: A dictionary indicating the action to take and any relevant parameters.
                             Returns {'action': 'none'} if no action is needed.
         """
-        logging.info(f"ActionAgent analyzing context for potential actions: {context_summary[:100]}...")
+        logger.info("ActionAgent analyzing context for potential actions: %s...", context_summary[:100])
 
         # --- Placeholder Logic (from Assignment 1) ---
         # In a real application, you would use an LLM with function calling
         # or rule-based logic to determine actions based on `context_summary`.
 
-        if "search the web for" in context_summary.lower():
-            query = context_summary.lower().split("search the web for", 1)[1].strip()
-            logging.info(f"Action: Web search requested for '{query}'")
+        # Collect every trigger in a single pass, remembering where each first appears.
+        lowered = context_summary.lower()
+        found = {}
+        for match in self._trigger_pattern.finditer(lowered):
+            found.setdefault(self._trigger_tags[match.lastgroup], match.end())
+
+        if "web_search" in found:
+            query = lowered[found["web_search"]:].strip()
+            logger.info("Action: Web search requested for '%s'", query)
             return {"action": "web_search", "query": query}
-        elif "save this information" in context_summary.lower():
-            logging.info("Action: Save information requested.")
+        elif "save_data" in found:
+            logger.info("Action: Save information requested.")
             return {"action": "save_data", "data": context_summary}
-        elif "schedule" in context_summary.lower() and "meeting" in context_summary.lower():
-            logging.info("Action: Meeting scheduling requested.")
+        elif "schedule" in found and "meeting" in found:
+            logger.info("Action: Meeting scheduling requested.")
             return {"action": "schedule_meeting", "details": context_summary}
         else:
-            logging.info("Action: No specific action determined.")
+            logger.info("Action: No specific action determined.")
             return {"action": "none"}
 
     def execute_action(self, action_data: Dict[str, Any]):
@@ -111,5 +168,38 @@ class ActionAgent:
         elif action_type == "none":
             pass # No action needed
         else:
-            logging.warning(f"Unknown action type: {action_type} passed to execute_action. This should have been caught by validate_action.")
+            logger.warning("Unknown action type: %s passed to execute_action. This should have been caught by validate_action.", action_type)
 
+    def decide_and_execute(self, context_summary: str, submit: Optional[Callable] = None) -> (str, Any):
+        """
+        Determines, validates and executes the action for a turn in one call.
+
+        Args:
+            context_summary (str): A summary or key insights from the context manager.
+            submit (Callable): Optional function used to run the action, e.g. `ThreadPoolExecutor.submit`
+                to run it in the background. Without it, the action runs inline.
+
+        Returns:
+            tuple[str, Any]: The action line for the UI, and whatever `submit` returned
+                (None if no action was executed, or if it ran inline).
+        """
+        action_data = self.determine_action(context_summary)
+        action_type = action_data["action"]
+
+        # --- GUARDRAIL STEP 2: Action Validation ---
+        is_valid, message = self.validate_action(action_data)
+        if not is_valid:
+            logger.warning("Action blocked by guardrail: %s", message)
+            return ACTION_BLOCKED_PREFIX + message, None
+        if action_type == "none":
+            logger.info("%sNo specific action determined.", ACTION_PREFIX)
+            return ACTION_PREFIX + "No specific action determined.", None
+
+        pending = submit(self.execute_action, action_data) if submit else self.execute_action(action_data)
+        action_message = f"{ACTION_PREFIX}{action_type} performed."
+        if 'query' in action_data:
+            action_message += f" (Query: '{action_data['query']}')"
+        elif 'details' in action_data:
+            action_message += f" (Details: '{action_data['details'][:50]}...')"
+        logger.info("%s", action_message)
+        return action_message, pending
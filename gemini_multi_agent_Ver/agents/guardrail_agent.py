@@ -1,11 +1,56 @@
 # File: agents/guardrail_agent.py
 import logging
+import re
+import threading
+from typing import Any, Optional, Union
 import google.generativeai as genai # Needed for safety settings constants
+try:
+    import hyperscan # Optional: SIMD multi-pattern matcher (x86 only); the re-based scanner is used without it
+except ImportError:
+    hyperscan = None
 from core.api_handler import GeminiAPIHandler
-from config import TEXT_MODEL, VISION_MODEL
+from core.response_cache import ResponseCache
+from config import TEXT_MODEL, VISION_MODEL, GUARDRAIL_SAFETY_PROBE, RESPONSE_CACHE_SIZE, MAX_TEXT_INPUT_CHARS
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Basic rule-based checks (can be expanded)
+MALICIOUS_KEYWORDS = ["delete all files", "hacking", "format hard drive", "steal credit card", "harm yourself", "do something illegal"]
+
+# Compiled once at import so every scan is a single case-insensitive pass over the input.
+_MALICIOUS_RE = re.compile("|".join(re.escape(keyword) for keyword in MALICIOUS_KEYWORDS), re.IGNORECASE)
+_MALICIOUS_DB = None
+if hyperscan is not None:
+    _MALICIOUS_DB = hyperscan.Database()
+    _MALICIOUS_DB.compile(
+        expressions=[re.escape(keyword).encode('utf-8') for keyword in MALICIOUS_KEYWORDS],
+        ids=list(range(len(MALICIOUS_KEYWORDS))),
+        elements=len(MALICIOUS_KEYWORDS),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH] * len(MALICIOUS_KEYWORDS),
+    )
+# A Hyperscan scratch space can only be used by one scan at a time, so each thread gets its own.
+_SCRATCH = threading.local()
+
+# Verdicts of the local fast path (see GuardrailAgent.fast_verdict).
+SAFE, BLOCK, ESCALATE = "safe", "block", "escalate"
+
+# Greetings and acknowledgements (compared lowercased, without surrounding punctuation/whitespace)
+# that are accepted without the safety probe. Anything not listed here is checked by Gemini.
+SAFE_SHORT_INPUTS = frozenset({
+    "", "hi", "hello", "hey", "thanks", "thank you", "ok", "okay", "yes", "no", "bye", "goodbye",
+})
+
+def _find_malicious_keyword(text_input: str) -> Optional[str]:
+    """Returns the first MALICIOUS_KEYWORDS entry found in the text, or None."""
+    if _MALICIOUS_DB is not None:
+        scratch = getattr(_SCRATCH, "scratch", None)
+        if scratch is None:
+            scratch = _SCRATCH.scratch = _MALICIOUS_DB.scratch.clone()
+        hits = []
+        _MALICIOUS_DB.scan(text_input.encode('utf-8'), match_event_handler=lambda pattern_id, start, end, flags, context: hits.append((end, pattern_id)), scratch=scratch)
+        return MALICIOUS_KEYWORDS[min(hits)[1]] if hits else None
+    match = _MALICIOUS_RE.search(text_input)
+    return match.group(0).lower() if match else None
 
 class GuardrailAgent:
     """
@@ -20,7 +65,8 @@ class GuardrailAgent:
             api_handler (GeminiAPIHandler): An instance of the Gemini API handler.
         """
         self.api_handler = api_handler
-        logging.info("GuardrailAgent initialized.")
+        self._cache = ResponseCache(RESPONSE_CACHE_SIZE) # Probe decisions for previously seen texts and images
+        logger.info("GuardrailAgent initialized.")
 
         # Default safety settings for Gemini API calls.
         # BLOCK_NONE means the API will block content only if it's very likely to be unsafe.
@@ -34,13 +80,34 @@ class GuardrailAgent:
 
     def _log_blocked_content(self, input_type: str, content: str, reason: str):
         """Logs details of blocked content."""
-        logging.warning(f"GUARDRAIL BLOCKED - Type: {input_type}, Reason: {reason}, Content: '{content[:100]}...'")
+        logger.warning("GUARDRAIL BLOCKED - Type: %s, Reason: %s, Content: '%s...'", input_type, reason, content[:100])
         # In a real system, you'd send this to a dedicated logging/monitoring service.
 
-    def scan_text_input(self, text_input: str) -> (bool, str):
+    def fast_verdict(self, text_input: str) -> (str, str):
+        """
+        Decides what it can about a text input locally, without any API call: inputs over
+        MAX_TEXT_INPUT_CHARS or containing MALICIOUS_KEYWORDS are blocked, and empty inputs or
+        SAFE_SHORT_INPUTS ("hi", "thanks!") are safe. Everything else needs Gemini's safety filters.
+
+        Args:
+            text_input (str): The user's text input.
+
+        Returns:
+            tuple[str, str]: The verdict (SAFE, BLOCK or ESCALATE) and a message.
         """
-        Scans text input for malicious content using Gemini's safety features
-        and basic rule-based checks.
+        if len(text_input) > MAX_TEXT_INPUT_CHARS:
+            self._log_blocked_content("text", text_input, f"Rule-based: input longer than {MAX_TEXT_INPUT_CHARS} characters")
+            return BLOCK, f"Your message is too long. Please keep it under {MAX_TEXT_INPUT_CHARS} characters."
+        is_safe, message = self.check_text_rules(text_input)
+        if not is_safe:
+            return BLOCK, message
+        if text_input.strip(" \t\r\n.,!?").lower() in SAFE_SHORT_INPUTS:
+            return SAFE, "Text input is safe."
+        return ESCALATE, message
+
+    def check_text_rules(self, text_input: str) -> (bool, str):
+        """
+        Runs only the local rule-based checks (see MALICIOUS_KEYWORDS). No API call is made.
 
         Args:
             text_input (str): The user's text input.
@@ -48,16 +115,29 @@ class GuardrailAgent:
         Returns:
             tuple[bool, str]: (True if safe, False if blocked), and a message.
         """
-        # 1. Basic Rule-Based Checks (can be expanded)
-        malicious_keywords = ["delete all files", "Hacking","format hard drive", "steal credit card", "harm yourself", "do something illegal"]
-        for keyword in malicious_keywords:
-            if keyword in text_input.lower():
-                self._log_blocked_content("text", text_input, f"Rule-based: detected '{keyword}'")
-                return False, "Your request contains content that violates our safety guidelines. Please rephrase your query."
-
-        # 2. Gemini API Safety Check (using a dummy call to trigger safety filters)
+        keyword = _find_malicious_keyword(text_input)
+        if keyword:
+            self._log_blocked_content("text", text_input, f"Rule-based: detected '{keyword}'")
+            return False, "Your request contains content that violates our safety guidelines. Please rephrase your query."
+        return True, "Text input passed rule-based checks."
+
+    def probe_text_input(self, text_input: str) -> (bool, str):
+        """
+        Checks text input against Gemini's safety filters with a minimal "probe" call.
+
+        Args:
+            text_input (str): The user's text input.
+
+        Returns:
+            tuple[bool, str]: (True if safe, False if blocked), and a message.
+        """
+        # Gemini API Safety Check (using a dummy call to trigger safety filters)
         # We make a minimal call just to see if the content is blocked by Gemini's internal filters.
         # This is a bit of a workaround as directly checking input safety isn't a standalone API.
+        cache_key = ResponseCache.make_key("probe_text", TEXT_MODEL, self.default_safety_settings, text_input)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
         try:
             # Use a very low temperature to make the model deterministic for this check
             # and a very short max_output_tokens as we don't care about the response, just if it's blocked.
@@ -67,45 +147,83 @@ class GuardrailAgent:
                 safety_settings=self.default_safety_settings,
                 generation_config={"temperature": 0.0, "max_output_tokens": 1}
             )
-            return True, "Text input is safe."
+            result = (True, "Text input is safe.")
         except genai.types.BlockedPromptException as e:
             self._log_blocked_content("text", text_input, f"Gemini API blocked: {e}")
-            return False, "Your request was blocked by safety filters. Please try a different query."
+            result = (False, "Your request was blocked by safety filters. Please try a different query.")
         except Exception as e:
-            logging.error(f"Error during Gemini safety scan for text: {e}")
+            logger.error("Error during Gemini safety scan for text: %s", e)
             # If the safety check itself fails, we might block or allow based on policy
             return False, "An internal error occurred during safety check. Please try again."
+        # Only definite decisions are cached; internal errors are retried on the next request.
+        self._cache.put(cache_key, result)
+        return result
 
 
-    def scan_image_input(self, image_data: bytes, user_prompt: str = None) -> (bool, str):
+    def scan_image_input(self, image_data: Union[bytes, memoryview], user_prompt: str = None, mime_type: str = 'image/jpeg') -> (bool, str):
         """
         Scans image input for malicious content using Gemini's safety features.
 
         Args:
-            image_data (bytes): The raw image data.
+            image_data (bytes | memoryview): The raw image data.
             user_prompt (str): Optional text prompt accompanying the image.
+            mime_type (str): The MIME type of `image_data`.
 
         Returns:
             tuple[bool, str]: (True if safe, False if blocked), and a message.
         """
         # Similar to text, use a dummy call to trigger vision model's safety filters
-        try:
-            vision_prompt = "Is this image safe? Describe any unsafe content if present."
-            if user_prompt:
-                vision_prompt = f"{vision_prompt} Also consider: {user_prompt}"
+        if not GUARDRAIL_SAFETY_PROBE:
+            return True, "Image input accepted; safety is enforced on the analysis call."
+        vision_prompt = "Is this image safe? Describe any unsafe content if present."
+        if user_prompt:
+            vision_prompt = f"{vision_prompt} Also consider: {user_prompt}"
 
+        cache_key = ResponseCache.make_key("probe_image", VISION_MODEL, self.default_safety_settings, image_data, vision_prompt)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached
+        try:
             self.api_handler.generate_vision_response(
                 model_name=VISION_MODEL,
                 image_data=image_data,
                 prompt=vision_prompt,
                 safety_settings=self.default_safety_settings,
+                mime_type=mime_type,
                 generation_config={"temperature": 0.0, "max_output_tokens": 1}
             )
-            return True, "Image input is safe."
+            result = (True, "Image input is safe.")
         except genai.types.BlockedPromptException as e:
             self._log_blocked_content("image", f"Image data (bytes) with prompt: {user_prompt}", f"Gemini API blocked: {e}")
-            return False, "The image you provided was blocked by safety filters. Please try a different image."
+            result = (False, "The image you provided was blocked by safety filters. Please try a different image.")
         except Exception as e:
-            logging.error(f"Error during Gemini safety scan for image: {e}")
+            logger.error("Error during Gemini safety scan for image: %s", e)
             return False, "An internal error occurred during image safety check. Please try again."
+        # As with text, internal errors are not cached.
+        self._cache.put(cache_key, result)
+        return result
+
+    def wrap_call(self, input_type: str, fn, *args, **kwargs) -> (bool, Any):
+        """
+        Runs a downstream agent call and turns a Gemini safety block into a guardrail block.
+        Pass `safety_settings=self.default_safety_settings` through to the call so the
+        safety filters are applied once, on the real request.
+
+        Args:
+            input_type (str): "text" or "image", used for logging and the user-facing message.
+            fn (Callable): The agent method to call (e.g., TextAgent.analyze_and_respond).
+            *args, **kwargs: Arguments forwarded to `fn`.
+
+        Returns:
+            tuple[bool, Any]: (True, the call's result) if it succeeded, or (False, a message) if blocked.
+        """
+        try:
+            return True, fn(*args, **kwargs)
+        except genai.types.BlockedPromptException as e:
+            if input_type == "image":
+                self._log_blocked_content("image", "Image data (bytes)", f"Gemini API blocked: {e}")
+                return False, "The image you provided was blocked by safety filters. Please try a different image."
+            content = args[0] if args and isinstance(args[0], str) else ""
+            self._log_blocked_content(input_type, content, f"Gemini API blocked: {e}")
+            return False, "Your request was blocked by safety filters. Please try a different query."
 
@@ -1,13 +1,28 @@
 # File: agents/image_agent.py (UPDATED)
 import logging
-from PIL import Image
+import orjson
+from PIL import Image, ImageOps
 import io
 import os # Added for os.path.exists check
+from typing import Union
 from core.api_handler import GeminiAPIHandler
-from config import VISION_MODEL
+from core.response_cache import ResponseCache
+from config import VISION_MODEL, MAX_IMAGE_EDGE, IMAGE_JPEG_QUALITY, RESPONSE_CACHE_SIZE, PREPARED_IMAGE_CACHE_SIZE
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Image formats that can be sent to Gemini as-is when they are already small enough.
+PASSTHROUGH_FORMATS = {"JPEG", "PNG", "WEBP"}
+
+# Structured output for a combined image turn: the analysis plus the reply shown to the user.
+IMAGE_TURN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "analysis": {"type": "STRING"},
+        "reply": {"type": "STRING"},
+    },
+    "required": ["analysis", "reply"],
+}
 
 class ImageAgent:
     """
@@ -21,39 +36,109 @@ class ImageAgent:
             api_handler (GeminiAPIHandler): An instance of the Gemini API handler.
         """
         self.api_handler = api_handler
-        logging.info("ImageAgent initialized.")
+        self._cache = ResponseCache(RESPONSE_CACHE_SIZE) # Results for previously seen images, keyed on the image bytes
+        self._prepared = ResponseCache(PREPARED_IMAGE_CACHE_SIZE) # prepare_image results, keyed on the uploaded bytes
+        logger.info("ImageAgent initialized.")
 
-    def analyze_image_from_bytes(self, image_data: bytes, user_prompt: str = None) -> str:
+    def prepare_image(self, image_data: Union[bytes, memoryview]) -> (Union[bytes, memoryview], str):
         """
-        Analyzes image data (bytes) and answers questions related to it.
+        Prepares uploaded image bytes for Gemini. Images larger than MAX_IMAGE_EDGE, or in a
+        format Gemini doesn't accept (e.g., GIF), are downscaled and re-encoded as JPEG.
+        Call this once per upload and reuse the result for every Gemini call on that image.
+        Re-uploads of the exact same bytes reuse the earlier result, so the prepared image (and
+        with it the cache keys of the guardrail and analysis calls) is identical.
 
         Args:
-            image_data (bytes): The raw image data.
-            user_prompt (str): An optional text prompt/question related to the image.
+            image_data (bytes | memoryview): The raw uploaded image data.
 
         Returns:
-            str: A textual analysis or answer related to the image.
+            tuple[bytes | memoryview, str]: The image data to send and its MIME type.
+                Images that need no changes are returned as the same buffer, without copying.
         Raises:
-            Exception: If image processing or API call fails.
+            ValueError: If the data is not a readable image.
         """
+        cache_key = ResponseCache.make_key("prepare", image_data)
+        cached = self._prepared.get(cache_key)
+        if cached is not None:
+            logger.info("Prepared image served from cache.")
+            return cached
+
+        # Image.open only reads the header; the pixel data is decoded lazily by the calls below,
+        # so a corrupt or truncated file can fail at any of them.
         try:
-            # Construct the prompt for the vision model
-            vision_prompt = "Analyze this image."
-            if user_prompt:
-                vision_prompt = f"{vision_prompt} Specifically, {user_prompt}"
+            img = Image.open(io.BytesIO(image_data))
+            if img.format in PASSTHROUGH_FORMATS and max(img.size) <= MAX_IMAGE_EDGE:
+                result = (image_data, Image.MIME[img.format])
+                self._prepared.put(cache_key, result)
+                return result
+
+            original_size, original_format = img.size, img.format
+            img = ImageOps.exif_transpose(img) # Keep the orientation once EXIF data is dropped
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+            buf = io.BytesIO()
+            img.convert("RGB").save(buf, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+        except Exception as e:
+            raise ValueError(f"The uploaded file is not a valid image: {e}") from e
+        prepared = buf.getvalue()
+        logger.info("Re-encoded %s image %s -> JPEG %s: %s -> %s bytes.", original_format, original_size, img.size, len(image_data), len(prepared))
+        self._prepared.put(cache_key, (prepared, "image/jpeg"))
+        return prepared, "image/jpeg"
+
+    def analyze_and_respond(self, image_data: Union[bytes, memoryview], user_prompt: str = None, history: list = None, safety_settings: list = None, mime_type: str = 'image/jpeg') -> (str, str):
+        """
+        Analyzes an image and drafts the user-facing reply in a single Gemini request,
+        instead of a separate analysis call followed by a ResponseAgent call.
+
+        Args:
+            image_data (bytes | memoryview): The raw image data.
+            user_prompt (str): An optional text prompt/question related to the image.
+            history (list): The conversation history for context.
+            safety_settings (list): Optional safety settings applied to the Gemini call.
+            mime_type (str): The MIME type of `image_data`.
 
-            logging.info(f"Sending image to Gemini Vision model '{VISION_MODEL}' with prompt: '{vision_prompt}'")
-            response_text = self.api_handler.generate_vision_response(
+        Returns:
+            tuple[str, str]: The image analysis and the reply for the user.
+        Raises:
+            Exception: If the API call fails.
+        """
+        vision_prompt = "Analyze this image."
+        if user_prompt:
+            vision_prompt = f"{vision_prompt} Specifically, {user_prompt}"
+        vision_prompt += (
+            "\n\nThen, based on your analysis and the conversation history, write a helpful and concise response to the user."
+            " Return JSON with 'analysis' (your analysis of the image) and 'reply' (the response to the user)."
+        )
+        cache_key = ResponseCache.make_key("analyze_and_respond", VISION_MODEL, image_data, vision_prompt, history, safety_settings)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info("Image analysis and reply served from cache.")
+            return cached
+
+        try:
+            logger.info("Sending image to Gemini Vision model '%s' for analysis and reply.", VISION_MODEL)
+            image_part = self.api_handler.build_image_part(image_data, mime_type)
+            response_text = self.api_handler.generate_multipart(
                 model_name=VISION_MODEL,
-                image_data=image_data,
-                prompt=vision_prompt
+                parts=[image_part, {'text': vision_prompt}],
+                response_schema=IMAGE_TURN_SCHEMA,
+                history=history,
+                safety_settings=safety_settings
             )
-            logging.info("Image analysis complete.")
-            return response_text
         except Exception as e:
-            logging.error(f"Error during image analysis: {e}")
+            logger.error("Error during image analysis: %s", e)
             raise
 
+        try:
+            result = orjson.loads(response_text)
+            analysis, reply = result["analysis"], result["reply"]
+        except (ValueError, KeyError, TypeError) as e:
+            # Fall back to the raw text rather than failing the whole turn.
+            logger.warning("Could not parse structured image response (%s). Using raw text.", e)
+            analysis = reply = response_text
+        self._cache.put(cache_key, (analysis, reply))
+        logger.info("Image analysis and reply complete.")
+        return analysis, reply
+
     # Removed analyze_image method that took a path, as we're now handling bytes directly from Flask upload.
     # If you still need path-based analysis for other purposes, you can keep it or re-add it.
 
@@ -2,8 +2,7 @@ import logging
 from core.api_handler import GeminiAPIHandler
 from config import TEXT_MODEL
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class ResponseAgent:
     """
@@ -17,7 +16,7 @@ class ResponseAgent:
             api_handler (GeminiAPIHandler): An instance of the Gemini API handler.
         """
         self.api_handler = api_handler
-        logging.info("ResponseAgent initialized.")
+        logger.info("ResponseAgent initialized.")
 
     def generate_response(self, context_summary: str, history: list) -> str:
         """
@@ -32,11 +31,33 @@ class ResponseAgent:
         """
         prompt = f"Based on the following context and conversation history, generate a helpful and concise response to the user. \n\nContext/Analysis: {context_summary}\n\n"
         
-        logging.info(f"Generating user response with Gemini model '{TEXT_MODEL}'.")
+        logger.info("Generating user response with Gemini model '%s'.", TEXT_MODEL)
         user_response = self.api_handler.generate_text(
             model_name=TEXT_MODEL,
             prompt=prompt,
             history=history # Pass history for better context understanding
         )
-        logging.info("User response generated.")
-        return user_response
\ No newline at end of file
+        logger.info("User response generated.")
+        return user_response
+
+    def generate_response_stream(self, context_summary: str, history: list):
+        """
+        Same as `generate_response`, but yields the response as it is generated
+        so the UI can start rendering before Gemini has finished.
+
+        Args:
+            context_summary (str): A summary or key insights from the context manager.
+            history (list): The full conversation history.
+
+        Yields:
+            str: The next piece of the user-friendly response.
+        """
+        prompt = f"Based on the following context and conversation history, generate a helpful and concise response to the user. \n\nContext/Analysis: {context_summary}\n\n"
+
+        logger.info("Streaming user response with Gemini model '%s'.", TEXT_MODEL)
+        yield from self.api_handler.stream_text(
+            model_name=TEXT_MODEL,
+            prompt=prompt,
+            history=history
+        )
+        logger.info("User response streamed.")
\ No newline at end of file
@@ -1,9 +1,22 @@
 import logging
+import orjson
 from core.api_handler import GeminiAPIHandler
-from config import TEXT_MODEL
+from core.response_cache import ResponseCache
+from config import TEXT_MODEL, RESPONSE_CACHE_SIZE
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Structured output for a combined text turn: the intent, the reply shown to the user,
+# and whether the turn asks for an action (in which case the reply is regenerated after it runs).
+TEXT_TURN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "intent": {"type": "STRING"},
+        "reply": {"type": "STRING"},
+        "needs_action": {"type": "BOOLEAN"},
+    },
+    "required": ["intent", "reply", "needs_action"],
+}
 
 class TextAgent:
     """
@@ -17,30 +30,53 @@ class TextAgent:
             api_handler (GeminiAPIHandler): An instance of the Gemini API handler.
         """
         self.api_handler = api_handler
-        logging.info("TextAgent initialized.")
+        self._cache = ResponseCache(RESPONSE_CACHE_SIZE) # Analyses of previously seen (input, history) pairs
+        logger.info("TextAgent initialized.")
 
-    def analyze_text(self, text_input: str, history: list) -> str:
+    def analyze_and_respond(self, text_input: str, history: list, safety_settings: list = None) -> (str, str, bool):
         """
-        Analyzes a given text input, potentially extracting intent or summarizing.
+        Extracts the intent of a text input and drafts the user-facing reply in a single Gemini
+        request, so simple turns don't need a separate ResponseAgent call.
 
         Args:
             text_input (str): The raw text input from the user.
             history (list): The conversation history for context.
+            safety_settings (list): Optional safety settings applied to the Gemini call.
 
         Returns:
-            str: A processed or analyzed version of the text input.
+            tuple[str, str, bool]: The intent, the reply for the user, and whether the turn asks
+                for an action (search, save, schedule). If the structured response can't be parsed,
+                the reply is None and `needs_action` is True, so the caller generates the reply itself.
         """
-        # The text agent can perform various NLP tasks.
-        # For simplicity, it will just echo the text and ask for clarification or provide a summary.
-        # In a real app, this could involve intent recognition, entity extraction, etc.
-
-        prompt = f"The user said: '{text_input}'. Based on the conversation history, what is the main intent or key information in this statement? Keep it concise for internal processing."
-        
-        logging.info(f"Analyzing text with Gemini model '{TEXT_MODEL}' for intent/summary.")
-        analysis_response = self.api_handler.generate_text(
+        prompt = (
+            f"The user said: '{text_input}'. Based on the conversation history, what is the main intent or key information in this statement?"
+            " Then write a helpful and concise response to the user."
+            " Return JSON with 'intent' (the intent, concise, for internal processing), 'reply' (the response to the user)"
+            " and 'needs_action' (true if the user asks to search the web, save information or schedule a meeting)."
+        )
+
+        cache_key = ResponseCache.make_key("analyze_and_respond", TEXT_MODEL, prompt, history, safety_settings)
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info("Text analysis and reply served from cache.")
+            return cached
+
+        logger.info("Analyzing text with Gemini model '%s' for intent and reply.", TEXT_MODEL)
+        response_text = self.api_handler.generate_multipart(
             model_name=TEXT_MODEL,
-            prompt=prompt,
-            history=history # Pass history for better context understanding
+            parts=[{'text': prompt}],
+            response_schema=TEXT_TURN_SCHEMA,
+            history=history,
+            safety_settings=safety_settings
         )
-        logging.info("Text analysis complete.")
-        return analysis_response
\ No newline at end of file
+
+        try:
+            result = orjson.loads(response_text)
+            intent, reply, needs_action = result["intent"], result["reply"], bool(result["needs_action"])
+        except (ValueError, KeyError, TypeError) as e:
+            # Keep the raw text as the analysis and let the caller generate the reply.
+            logger.warning("Could not parse structured text response (%s). Using raw text.", e)
+            intent, reply, needs_action = response_text, None, True
+        self._cache.put(cache_key, (intent, reply, needs_action))
+        logger.info("Text analysis and reply complete.")
+        return intent, reply, needs_action
\ No newline at end of file
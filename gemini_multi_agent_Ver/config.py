@@ -17,6 +17,37 @@ if not GEMINI_API_KEY:
 TEXT_MODEL = "gemini-1.5-flash"
 VISION_MODEL = "gemini-1.5-flash" # Use a vision-capable model for image inputs
 
-# History file path
-HISTORY_FILE = "history.json"
+# Transport used by the Gemini SDK. "grpc" keeps one persistent, multiplexed HTTP/2 channel
+# that every agent's calls share; "rest" is available for networks that block gRPC.
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "grpc")
+
+# Uploaded images larger than this (in pixels, on either edge) are downscaled
+# and re-encoded as JPEG before being sent to Gemini.
+MAX_IMAGE_EDGE = 1024
+IMAGE_JPEG_QUALITY = 85
+
+# Whether the app sends a 1-token request at startup, so the connection to Gemini is already
+# open (and the API key checked) before the first user request.
+WARMUP_PING = os.getenv("WARMUP_PING", "true").lower() == "true"
+
+# Number of recent agent results kept in each agent's in-process cache.
+RESPONSE_CACHE_SIZE = 256
+
+# Number of recently uploaded images whose prepared (downscaled/re-encoded) form is kept,
+# so re-uploading the same image skips decoding and resizing it again.
+PREPARED_IMAGE_CACHE_SIZE = 32
+
+# Log level for the app's loggers (e.g., "INFO" while developing, "WARNING" in production).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# History file path (JSON Lines: one message per line)
+HISTORY_FILE = "history.jsonl"
+
+# Whether GuardrailAgent makes its own Gemini "safety probe" call before the real agent call.
+# Off by default: the downstream agent calls apply the same safety settings, so a blocked
+# prompt is still caught there without paying an extra API round-trip on every turn.
+GUARDRAIL_SAFETY_PROBE = os.getenv("GUARDRAIL_SAFETY_PROBE", "false").lower() == "true"
+
+# Local guardrail limit: longer text inputs are blocked outright, without the safety probe.
+MAX_TEXT_INPUT_CHARS = 8000
 
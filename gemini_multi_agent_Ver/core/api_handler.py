@@ -2,23 +2,93 @@
 import google.generativeai as genai
 import time
 import logging
+from typing import Union
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 class GeminiAPIHandler:
     """
     Handles interactions with the Gemini API, including error handling and retries.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, transport: str = "grpc"):
         """
-        Initializes the Gemini API handler.
+        Initializes the Gemini API handler. Create one handler and share it between agents:
+        the SDK client (and its connection) is set up once, here.
 
         Args:
             api_key (str): Your Gemini API key.
+            transport (str): The SDK transport, "grpc" (one persistent HTTP/2 channel) or "rest".
         """
-        genai.configure(api_key=api_key)
+        genai.configure(api_key=api_key, transport=transport)
         self.api_key = api_key
+        # GenerativeModel instances are reused across calls instead of being rebuilt per request.
+        self._model_cache = {}
+
+    def _get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Returns the cached GenerativeModel for `model_name`, creating it on first use."""
+        model = self._model_cache.get(model_name)
+        if model is None:
+            model = self._model_cache[model_name] = genai.GenerativeModel(model_name=model_name)
+        return model
+
+    def warmup(self, model_names: list, ping: bool = False):
+        """
+        Does one-time setup ahead of the first real request: builds the models and, with `ping`,
+        sends a 1-token request so the connection to Gemini is already established.
+
+        Args:
+            model_names (list): The models the agents will use.
+            ping (bool): Whether to make the (billed, but minimal) warm-up request.
+        """
+        for model_name in model_names:
+            self._get_model(model_name)
+        if ping and model_names:
+            self._get_model(model_names[0]).generate_content("ping", generation_config={"max_output_tokens": 1})
+            logger.info("Gemini connection warmed up.")
+
+    def _build_contents(self, history: list, parts: list) -> list:
+        """
+        Converts chat history plus the new user turn into Gemini's `contents` format.
+
+        Args:
+            history (list): Previous chat messages ({'role', 'content'} dicts), or None.
+            parts (list): The parts of the new user turn.
+
+        Returns:
+            list: The contents list, oldest turn first.
+        """
+        contents = [{'role': item['role'], 'parts': [{'text': item['content']}]} for item in history] if history else []
+        contents.append({'role': 'user', 'parts': parts})
+        return contents
+
+    def build_image_part(self, image_data: Union[bytes, memoryview], mime_type: str = 'image/jpeg') -> dict:
+        """
+        Wraps image data as a Gemini content part. `bytes` are used as-is (no copy); other
+        buffers such as memoryview are converted to bytes exactly once, here, because the SDK needs bytes.
+
+        Args:
+            image_data (bytes | memoryview): The image data.
+            mime_type (str): The MIME type of `image_data`.
+
+        Returns:
+            dict: The image part.
+        """
+        if not isinstance(image_data, bytes):
+            image_data = bytes(image_data)
+        return {'mime_type': mime_type, 'data': image_data}
+
+    def _raise_if_blocked(self, response):
+        """
+        Raises BlockedPromptException for a blocked response. The SDK only records the block on
+        the response (reading `response.text` then fails with a ValueError), so callers such as
+        GuardrailAgent.wrap_call would otherwise never see the exception they handle.
+        """
+        block_reason = response.prompt_feedback.block_reason
+        if block_reason:
+            raise genai.types.BlockedPromptException(f"Prompt blocked: {getattr(block_reason, 'name', block_reason)}")
+        for candidate in response.candidates:
+            if getattr(candidate.finish_reason, 'name', None) == "SAFETY":
+                raise genai.types.BlockedPromptException("Response blocked by safety filters.")
 
     def _call_gemini_model(self, model_name: str, contents: list, stream: bool = False, safety_settings: list = None, **kwargs): # ADD safety_settings
         """
@@ -34,23 +104,26 @@ class GeminiAPIHandler:
         Returns:
             google.generativeai.types.GenerateContentResponse: The response from the Gemini API.
         Raises:
+            genai.types.BlockedPromptException: If the (non-streamed) prompt or its response was blocked by safety filters.
             Exception: If the API call fails after retries.
         """
-        model = genai.GenerativeModel(model_name=model_name)
+        model = self._get_model(model_name)
         retries = 3
         delay = 2  # seconds
 
         for i in range(retries):
             try:
-                logging.info(f"Calling Gemini model '{model_name}' (Attempt {i+1}/{retries})...")
+                logger.info("Calling Gemini model '%s' (Attempt %s/%s)...", model_name, i+1, retries)
                 # Pass safety_settings to generate_content
                 response = model.generate_content(contents, stream=stream, safety_settings=safety_settings, **kwargs)
+                if not stream:
+                    self._raise_if_blocked(response)
                 return response
             except genai.types.BlockedPromptException as e:
-                logging.error(f"Prompt blocked by safety settings: {e}")
+                logger.error("Prompt blocked by safety settings: %s", e)
                 raise # Re-raise BlockedPromptException to be handled by GuardrailAgent
             except Exception as e:
-                logging.warning(f"API call failed: {e}. Retrying in {delay} seconds...")
+                logger.warning("API call failed: %s. Retrying in %s seconds...", e, delay)
                 time.sleep(delay)
                 delay *= 2  # Exponential backoff
         raise Exception(f"Failed to call Gemini API after {retries} attempts.")
@@ -69,34 +142,49 @@ class GeminiAPIHandler:
         Returns:
             str: The generated text.
         """
-        contents = []
-        if history:
-            for item in history:
-                contents.append({'role': item['role'], 'parts': [{'text': item['content']}]})
-        contents.append({'role': 'user', 'parts': [{'text': prompt}]})
+        contents = self._build_contents(history, [{'text': prompt}])
 
         response = self._call_gemini_model(model_name, contents, safety_settings=safety_settings, **kwargs) # Pass safety_settings
         return response.text
 
-    def generate_vision_response(self, model_name: str, image_data: bytes, prompt: str = None, safety_settings: list = None, **kwargs): # ADD safety_settings
+    def stream_text(self, model_name: str, prompt: str, history: list = None, safety_settings: list = None, **kwargs):
+        """
+        Generates text like `generate_text`, but yields it chunk by chunk as Gemini produces it.
+
+        Args:
+            model_name (str): The name of the text model.
+            prompt (str): The text prompt.
+            history (list): Optional list of previous chat messages for context.
+            safety_settings (list): Optional list of safety settings to apply.
+            **kwargs: Additional arguments for generate_content.
+
+        Yields:
+            str: The next piece of generated text.
+        """
+        contents = self._build_contents(history, [{'text': prompt}])
+
+        response = self._call_gemini_model(model_name, contents, stream=True, safety_settings=safety_settings, **kwargs)
+        for chunk in response:
+            if chunk.parts: # The final chunk may only carry the finish reason
+                yield chunk.text
+
+    def generate_vision_response(self, model_name: str, image_data: Union[bytes, memoryview], prompt: str = None, safety_settings: list = None, mime_type: str = 'image/jpeg', **kwargs): # ADD safety_settings
         """
         Generates a response from a vision-capable Gemini model with an image and optional text.
 
         Args:
             model_name (str): The name of the vision model (e.g., "gemini-1.5-flash").
-            image_data (bytes): The raw image data.
+            image_data (bytes | memoryview): The raw image data.
             prompt (str): Optional text prompt to accompany the image.
             safety_settings (list): Optional list of safety settings to apply. # NEW ARG
+            mime_type (str): The MIME type of `image_data`.
             **kwargs: Additional arguments for generate_content.
 
         Returns:
             str: The generated text response.
         """
-        # Create a GenerativeModel instance for the vision model
-        model = genai.GenerativeModel(model_name=model_name)
-
         # Prepare content for the vision model
-        image_part = {'mime_type': 'image/jpeg', 'data': image_data} # Assuming JPEG, adjust if needed
+        image_part = self.build_image_part(image_data, mime_type)
 
         contents = [image_part]
         if prompt:
@@ -105,3 +193,27 @@ class GeminiAPIHandler:
         response = self._call_gemini_model(model_name, contents, safety_settings=safety_settings, **kwargs) # Pass safety_settings
         return response.text
 
+    def generate_multipart(self, model_name: str, parts: list, response_schema: dict, history: list = None, safety_settings: list = None, **kwargs):
+        """
+        Sends a single multi-part user turn (e.g., image + text) and asks for structured JSON output.
+        This lets one request cover work that would otherwise take several round-trips.
+
+        Args:
+            model_name (str): The name of the model (e.g., "gemini-1.5-flash").
+            parts (list): The parts of the user turn (image parts and/or {'text': ...} parts).
+            response_schema (dict): The JSON schema the response must follow.
+            history (list): Optional list of previous chat messages for context.
+            safety_settings (list): Optional list of safety settings to apply.
+            **kwargs: Additional arguments for generate_content.
+
+        Returns:
+            str: The generated JSON text.
+        """
+        contents = self._build_contents(history, parts)
+
+        generation_config = dict(kwargs.pop('generation_config', None) or {})
+        generation_config.update({"response_mime_type": "application/json", "response_schema": response_schema})
+
+        response = self._call_gemini_model(model_name, contents, safety_settings=safety_settings, generation_config=generation_config, **kwargs)
+        return response.text
+
@@ -1,62 +1,154 @@
 # File: core/context_manager.py
-import json
+import atexit
 import logging
 import os
-from typing import List, Dict, Any
+import queue
+import threading
+from collections import deque
+from typing import Deque, List, Dict, Any, Optional, Sequence, Tuple
+import orjson
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# The append-only history file is compacted once it holds this many times `max_history_turns` lines.
+COMPACTION_FACTOR = 10
 
 class ContextManager:
     """
     Manages the conversation history and context for the multi-agent system.
     Handles loading, saving, and updating the conversation state.
+    History is persisted as JSON Lines (one message per line) so each new message is a single append.
+    File writes happen on a background writer thread, so request threads never wait on disk I/O.
     """
-    def __init__(self, history_file: str = "history.json", max_history_turns: int = 10):
+    def __init__(self, history_file: str = "history.jsonl", max_history_turns: int = 10):
         """
         Initializes the ContextManager.
 
         Args:
-            history_file (str): Path to the JSON file for persistent history.
+            history_file (str): Path to the JSON Lines file for persistent history.
             max_history_turns (int): Maximum number of turns to keep in memory for context.
         """
         self.history_file = history_file
         self.max_history_turns = max_history_turns
-        self.conversation_history: List[Dict[str, Any]] = self._load_history()
-        logging.info(f"ContextManager initialized. Loaded {len(self.conversation_history)} turns from {history_file}.")
+        # Guards the in-memory state; request threads may update the history concurrently.
+        self._lock = threading.RLock()
+        self._persisted_lines = 0 # Lines currently in the history file, used to decide when to compact
+        # A bounded deque drops the oldest turn in O(1) once max_history_turns is reached.
+        self.conversation_history: Deque[Dict[str, Any]] = self._load_history()
+        # Immutable copy of the history handed to readers; rebuilt only after the history changes.
+        self._snapshot: Optional[Tuple[Dict[str, Any], ...]] = None
+
+        # Pending ("append" | "rewrite", bytes) file operations, applied in order by the writer thread.
+        self._write_queue: "queue.Queue[Tuple[str, bytes]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.flush)
+        logger.info("ContextManager initialized. Loaded %s turns from %s.", len(self.conversation_history), history_file)
 
-    def _load_history(self) -> List[Dict[str, Any]]:
+    def _load_history(self) -> Deque[Dict[str, Any]]:
         """
-        Loads conversation history from the specified JSON file.
+        Loads the most recent turns from the specified JSON Lines file.
+        Invalid lines are skipped rather than discarding the whole history.
         """
-        if os.path.exists(self.history_file):
-            try:
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                    # Ensure history is a list of dictionaries with 'role' and 'content'
-                    if isinstance(history, list) and all(isinstance(item, dict) and 'role' in item and 'content' in item for item in history):
-                        return history
+        history = deque(maxlen=self.max_history_turns)
+        if not os.path.exists(self.history_file):
+            self._migrate_legacy_history()
+        if not os.path.exists(self.history_file):
+            return history
+        try:
+            with open(self.history_file, 'rb') as f:
+                for line_number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    self._persisted_lines += 1
+                    try:
+                        item = orjson.loads(line)
+                    except orjson.JSONDecodeError as e:
+                        logger.warning("Skipping undecodable line %s in %s: %s", line_number, self.history_file, e)
+                        continue
+                    # Ensure each entry is a dictionary with 'role' and 'content'
+                    if isinstance(item, dict) and 'role' in item and 'content' in item:
+                        history.append(item)
                     else:
-                        logging.warning(f"Invalid history format in {self.history_file}. Starting with empty history.")
-                        return []
-            except json.JSONDecodeError as e:
-                logging.error(f"Error decoding JSON from {self.history_file}: {e}. Starting with empty history.")
-                return []
-            except Exception as e:
-                logging.error(f"Error loading history from {self.history_file}: {e}. Starting with empty history.")
-                return []
-        return []
+                        logger.warning("Skipping invalid entry on line %s in %s.", line_number, self.history_file)
+        except Exception as e:
+            logger.error("Error loading history from %s: %s. Starting with empty history.", self.history_file, e)
+            return deque(maxlen=self.max_history_turns)
+        return history
 
-    def _save_history(self):
+    def _migrate_legacy_history(self):
         """
-        Saves the current conversation history to the JSON file.
+        Converts the JSON array history file used before JSON Lines (e.g., history.json next to
+        history.jsonl) into `history_file`, once. The old file is left in place.
         """
+        legacy_file = os.path.splitext(self.history_file)[0] + ".json"
+        if legacy_file == self.history_file or not os.path.exists(legacy_file):
+            return
         try:
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversation_history, f, indent=4)
-            logging.info(f"Conversation history saved to {self.history_file}.")
+            with open(legacy_file, 'rb') as f:
+                items = orjson.loads(f.read())
+            if not isinstance(items, list):
+                raise ValueError("expected a JSON array")
+            with open(self.history_file, 'xb') as f:
+                f.write(b"".join(orjson.dumps(item) + b"\n" for item in items))
+        except FileExistsError:
+            return
         except Exception as e:
-            logging.error(f"Error saving history to {self.history_file}: {e}")
+            logger.warning("Could not convert legacy history %s to %s: %s. Starting with empty history.", legacy_file, self.history_file, e)
+            return
+        logger.warning("Converted legacy history %s (%s entries) to %s.", legacy_file, len(items), self.history_file)
+
+    def _append_messages(self, messages: List[Dict[str, Any]]):
+        """
+        Queues messages to be appended to the history file (as one write), compacting the file when it grows too long.
+        Must be called with the lock held.
+        """
+        self._write_queue.put(("append", b"".join(orjson.dumps(message) + b"\n" for message in messages)))
+        self._persisted_lines += len(messages)
+        if self._persisted_lines > COMPACTION_FACTOR * self.max_history_turns:
+            self._save_history()
+
+    def _save_history(self):
+        """
+        Queues a rewrite of the history file with only the current in-memory conversation history.
+        Must be called with the lock held, so the snapshot is ordered correctly with the queued appends.
+        """
+        snapshot = b"".join(orjson.dumps(message) + b"\n" for message in self.conversation_history)
+        self._write_queue.put(("rewrite", snapshot))
+        self._persisted_lines = len(self.conversation_history)
+
+    def _write_loop(self):
+        """
+        Writer thread: applies queued file operations, draining everything queued so far
+        into one open/write per batch. A rewrite supersedes the appends queued before it.
+        """
+        while True:
+            batch = [self._write_queue.get()]
+            while True:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            rewrites = [i for i, (op, _) in enumerate(batch) if op == "rewrite"]
+            start = rewrites[-1] if rewrites else 0
+            mode = 'wb' if rewrites else 'ab'
+            try:
+                with open(self.history_file, mode) as f:
+                    f.write(b"".join(data for _, data in batch[start:]))
+                if rewrites:
+                    logger.info("Conversation history saved to %s.", self.history_file)
+            except Exception as e:
+                logger.error("Error writing history to %s: %s", self.history_file, e)
+            finally:
+                for _ in batch:
+                    self._write_queue.task_done()
+
+    def flush(self):
+        """
+        Blocks until every queued history write has reached the file (also run at interpreter exit).
+        """
+        self._write_queue.join()
 
     def add_message(self, role: str, content: Any):
         """
@@ -66,37 +158,59 @@ class ContextManager:
             role (str): The role of the speaker ("user" or "model").
             content (Any): The content of the message (text, or a representation of image analysis).
         """
-        self.conversation_history.append({'role': role, 'content': content})
-        # Keep only the most recent turns to manage context length
-        if len(self.conversation_history) > self.max_history_turns:
-            self.conversation_history = self.conversation_history[-self.max_history_turns:]
-        self._save_history()
-        logging.info(f"Added message to history (role: {role}). Current history length: {len(self.conversation_history)}")
+        self.add_messages([{'role': role, 'content': content}])
+
+    def add_messages(self, messages: List[Dict[str, Any]]):
+        """
+        Adds several messages to the conversation history at once, in order,
+        with a single lock acquisition and a single queued file write.
+
+        Args:
+            messages (list): The messages, as {'role': ..., 'content': ...} dicts.
+        """
+        if not messages:
+            return
+        with self._lock:
+            # The deque keeps only the most recent turns to manage context length
+            self.conversation_history.extend(messages)
+            self._snapshot = None
+            self._append_messages(messages)
+            history_length = len(self.conversation_history)
+        if logger.isEnabledFor(logging.INFO): # Skip building the role list when INFO is off
+            logger.info("Added %s message(s) to history (roles: %s). Current history length: %s", len(messages), ', '.join(message['role'] for message in messages), history_length)
+
+    def _get_snapshot(self) -> Tuple[Dict[str, Any], ...]:
+        """Returns the current history snapshot, rebuilding it if the history changed. Must be called with the lock held."""
+        if self._snapshot is None:
+            self._snapshot = tuple(self.conversation_history)
+        return self._snapshot
 
-    def get_full_history(self) -> List[Dict[str, Any]]:
+    def get_full_history(self) -> Sequence[Dict[str, Any]]:
         """
-        Returns the full conversation history.
+        Returns the full conversation history (e.g., for JSON responses).
+        The result is a shared, read-only snapshot: repeated calls between updates cost nothing.
         """
-        return self.conversation_history
+        with self._lock:
+            return self._get_snapshot()
 
     def clear_history(self):
         """
         Clears the entire conversation history.
         """
-        self.conversation_history = []
-        self._save_history()
-        logging.info("Conversation history cleared.")
+        with self._lock:
+            self.conversation_history.clear()
+            self._snapshot = None
+            self._save_history()
+        logger.info("Conversation history cleared.")
 
     def get_context_for_llm(self) -> List[Dict[str, str]]:
         """
         Prepares a simplified history format suitable for LLM context.
         This method returns a list of dictionaries, each with 'role' and 'content' keys,
         which is the format expected by api_handler.py's generate_text method for its 'history' argument.
+        Turns are returned as-is (they are only read downstream), so no per-turn dicts are copied.
         """
-        llm_context = []
-        for turn in self.conversation_history:
-            # Only include text content for the LLM context.
-            # The api_handler.py's generate_text will convert this into the 'parts' format.
-            if isinstance(turn['content'], str):
-                llm_context.append({'role': turn['role'], 'content': turn['content']}) # Corrected: return 'content' directly
-        return llm_context
+        # Only include text content for the LLM context.
+        # The api_handler.py's generate_text will convert this into the 'parts' format.
+        with self._lock:
+            return [turn for turn in self._get_snapshot() if isinstance(turn['content'], str)]
@@ -0,0 +1,55 @@
+# File: core/response_cache.py
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+class ResponseCache:
+    """
+    A small in-process LRU cache for agent results, keyed by a SHA-256 digest of the inputs.
+    Lets repeated identical requests skip the Gemini round-trip entirely.
+    """
+    def __init__(self, max_entries: int = 256):
+        """
+        Initializes the ResponseCache.
+
+        Args:
+            max_entries (int): Maximum number of results to keep before evicting the least recently used.
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Any]" = OrderedDict()
+        self._lock = threading.Lock() # Agents may be called from several request threads at once
+
+    @staticmethod
+    def make_key(*parts: Any) -> bytes:
+        """
+        Builds a cache key from the inputs that determine a result.
+
+        Args:
+            *parts: The inputs (model name, prompt, image bytes, history, ...). Non-bytes values are hashed via str().
+
+        Returns:
+            bytes: The SHA-256 digest of the parts.
+        """
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part if isinstance(part, (bytes, bytearray, memoryview)) else str(part).encode('utf-8')
+            digest.update(len(data).to_bytes(8, 'big')) # Length prefix so ("ab", "c") != ("a", "bc")
+            digest.update(data)
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[Any]:
+        """Returns the cached result for `key` (marking it as recently used), or None on a miss."""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: bytes, value: Any):
+        """Stores a result, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
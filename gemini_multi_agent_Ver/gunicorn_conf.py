@@ -0,0 +1,20 @@
+# File: gunicorn_conf.py
+# Production server settings. Run from this directory with:
+#   gunicorn -c gunicorn_conf.py main:app
+import os
+
+# Only warnings and errors in production, unless LOG_LEVEL is set explicitly.
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+bind = os.getenv("BIND", "127.0.0.1:5000")
+
+# gevent workers yield while waiting on Gemini, so one worker serves many requests at once.
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = 1000
+
+# The conversation history lives in each worker's memory (see ContextManager), so more than
+# one worker would give each its own diverging history. Scale with worker_connections instead.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+# Streamed replies can take a while; don't kill a worker in the middle of one.
+timeout = 120
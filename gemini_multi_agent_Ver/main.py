@@ -1,30 +1,49 @@
 # File: main.py
 import os
+try:
+    from gevent import monkey
+except ImportError: # gevent is only needed when serving with gevent
+    monkey = None
+if os.getenv("GEVENT_PATCH", "false").lower() == "true":
+    # For running under gevent outside gunicorn's gevent worker (which patches on its own).
+    # Must happen before the Gemini SDK (or anything else) imports socket, ssl or threading.
+    if monkey is None:
+        raise RuntimeError("GEVENT_PATCH is set, but gevent is not installed.")
+    monkey.patch_all()
+if monkey is not None and monkey.is_module_patched("socket"):
+    # Sockets are gevent's, either from GEVENT_PATCH above or from gunicorn's gevent worker
+    # (which patches before loading the app), so gRPC (the default Gemini transport) must cooperate.
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+import re
 import sys
 import logging
-from flask import Flask, request, jsonify, send_from_directory
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from werkzeug.utils import secure_filename
-from PIL import Image # Used for checking image validity, not direct processing in Flask
 
 # Add the project root to the Python path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import GEMINI_API_KEY, HISTORY_FILE
+from config import (GEMINI_API_KEY, GEMINI_TRANSPORT, LOG_LEVEL, HISTORY_FILE, GUARDRAIL_SAFETY_PROBE, TEXT_MODEL,
+                    VISION_MODEL, WARMUP_PING)
 from core.api_handler import GeminiAPIHandler
 from core.context_manager import ContextManager
-from agents.guardrail_agent import GuardrailAgent # NEW IMPORT
+from agents.guardrail_agent import GuardrailAgent, BLOCK, ESCALATE # NEW IMPORT
 from agents.image_agent import ImageAgent
 from agents.text_agent import TextAgent
 from agents.response_agent import ResponseAgent
 from agents.action_agent import ActionAgent
 
-# Configure logging for Flask and agents
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Configure logging for Flask and agents (the only place logging is configured)
+logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='static')
 
 # Initialize core components and agents globally for the Flask app
-api_handler = GeminiAPIHandler(api_key=GEMINI_API_KEY)
+api_handler = GeminiAPIHandler(api_key=GEMINI_API_KEY, transport=GEMINI_TRANSPORT) # Shared by all agents, so they share one connection
 context_manager = ContextManager(history_file=HISTORY_FILE)
 guardrail_agent = GuardrailAgent(api_handler=api_handler) # NEW AGENT INITIALIZATION
 image_agent = ImageAgent(api_handler=api_handler)
@@ -32,13 +51,66 @@ text_agent = TextAgent(api_handler=api_handler)
 response_agent = ResponseAgent(api_handler=api_handler)
 action_agent = ActionAgent()
 
+# Shared worker pool for running independent Gemini calls at the same time.
+# (Threads rather than asyncio: Flask views here are synchronous.)
+executor = ThreadPoolExecutor(max_workers=8)
+
+def _warmup():
+    """Moves one-time setup (model construction, connecting to Gemini) off the first request's path."""
+    try:
+        api_handler.warmup([TEXT_MODEL, VISION_MODEL], ping=WARMUP_PING)
+    except Exception as e:
+        logger.warning("Warm-up failed (the first request will pay the setup cost instead): %s", e)
+
+# In the background, so startup isn't delayed by the warm-up request.
+executor.submit(_warmup)
+
+# Prefixes of the analysis, action and reply sections shown in the UI (and stored in the history)
+IMAGE_ANALYSIS_PREFIX = "[Image Analysis]: "
+TEXT_ANALYSIS_PREFIX = "[Text Analysis]: "
+REPLY_PREFIX = "Gemini: "
+SECTION_SEPARATOR = "\n\n"
+
 # Allowed image extensions for upload
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+_ALLOWED_RE = re.compile(r".+\.(?:png|jpe?g|gif|webp)", re.IGNORECASE)
 
-def allowed_file(filename):
-    """Checks if the uploaded file has an allowed extension."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+# Checks if the uploaded file has an allowed extension (returns a truthy match or None).
+allowed_file = _ALLOWED_RE.fullmatch
+
+def blocked_input_response(user_entry: str, guardrail_message: str):
+    """Records a turn blocked by the input guardrail and builds the response for the UI."""
+    logger.warning("Input blocked by guardrail: %s", guardrail_message)
+    context_manager.add_messages([
+        {'role': "user", 'content': user_entry},
+        {'role': "model", 'content': f"[Guardrail]: {guardrail_message}"},
+    ])
+    return jsonify({"response": f"System: {guardrail_message}", "history": context_manager.get_full_history()})
+
+def sse_event(payload: dict) -> bytes:
+    """Formats a payload as a single server-sent event."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def stream_chat_response(header: str, reply_chunks, action_future=None):
+    """
+    Streams a chat response as server-sent events: first the analysis/action header,
+    then the reply as it is generated. The rest of the turn is already in the history when
+    streaming starts; the reply is added once it has been streamed in full.
+    If an action is running in the background (`action_future`), it is awaited before the final event.
+    """
+    chunks = []
+    try:
+        yield sse_event({"delta": header})
+        for chunk in reply_chunks:
+            chunks.append(chunk)
+            yield sse_event({"delta": chunk})
+        if action_future is not None:
+            action_future.result()
+    except Exception as e:
+        logger.exception("An error occurred while streaming the response.")
+        yield sse_event({"error": str(e)})
+        return
+    context_manager.add_message("model", "".join(chunks))
+    yield sse_event({"done": True, "history": context_manager.get_full_history()})
 
 @app.route('/')
 def index():
@@ -49,98 +121,130 @@ def index():
 def chat():
     """
     Handles chat requests, supporting both text and image inputs.
+    Clients that accept 'text/event-stream' get the final response streamed as it is generated.
     """
     user_input_text = request.form.get('text_input', '').strip()
     uploaded_file = request.files.get('image_file')
+    has_image = bool(uploaded_file) and bool(allowed_file(uploaded_file.filename or ''))
+    wants_stream = request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
 
     llm_history = context_manager.get_context_for_llm()
     context_summary = ""
     gemini_response = ""
     action_message = ""
+    final_response_text = None
+    analysis_future = None
     
     # --- GUARDRAIL STEP 1: Input Validation ---
     is_input_safe = True
     guardrail_message = ""
 
-    if uploaded_file and allowed_file(uploaded_file.filename):
-        image_data = uploaded_file.read()
-        is_input_safe, guardrail_message = guardrail_agent.scan_image_input(image_data, user_prompt=user_input_text)
-        # Reset stream position after reading for potential re-reading by agents if needed,
-        # though in this flow, image_data is passed directly.
-        uploaded_file.seek(0)
+    if has_image:
+        try:
+            # Downscale/re-encode once; the result is used for every Gemini call on this image.
+            image_data, image_mime_type = image_agent.prepare_image(uploaded_file.stream.read())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        is_input_safe, guardrail_message = guardrail_agent.scan_image_input(image_data, user_prompt=user_input_text, mime_type=image_mime_type)
     elif user_input_text:
-        is_input_safe, guardrail_message = guardrail_agent.scan_text_input(user_input_text)
+        verdict, guardrail_message = guardrail_agent.fast_verdict(user_input_text)
+        is_input_safe = verdict != BLOCK
+        if verdict == ESCALATE and GUARDRAIL_SAFETY_PROBE:
+            # Run the safety probe and the text analysis concurrently.
+            # The analysis result is discarded if the probe blocks the input.
+            probe_future = executor.submit(guardrail_agent.probe_text_input, user_input_text)
+            analysis_future = executor.submit(
+                guardrail_agent.wrap_call, "text", text_agent.analyze_and_respond, user_input_text,
+                history=llm_history, safety_settings=guardrail_agent.default_safety_settings
+            )
+            is_input_safe, guardrail_message = probe_future.result()
     else:
         return jsonify({"error": "No text or image input provided."}), 400
 
+    image_filename = secure_filename(uploaded_file.filename) if has_image else ""
+    user_entry = user_input_text if user_input_text else f"[Image: {image_filename}]"
     if not is_input_safe:
         # Input was blocked by guardrails
-        logging.warning(f"Input blocked by guardrail: {guardrail_message}")
-        context_manager.add_message("user", user_input_text if user_input_text else f"[Image: {uploaded_file.filename}]")
-        context_manager.add_message("model", f"[Guardrail]: {guardrail_message}")
-        return jsonify({"response": f"System: {guardrail_message}", "history": context_manager.get_full_history()})
+        return blocked_input_response(user_entry, guardrail_message)
 
+    # Messages for this turn, saved to the history together once the turn is complete
+    # (or, for a streamed reply, once streaming starts).
+    pending_messages = []
 
     try:
-        if uploaded_file and allowed_file(uploaded_file.filename):
+        if has_image:
             # Process image input (only if safe)
-            logging.info(f"Received image file: {uploaded_file.filename}")
-            # Re-read image data if it was consumed by guardrail_agent.scan_image_input
-            # For simplicity, we read once and pass the bytes. If the guardrail agent
-            # consumed the stream, you'd need to re-read or pass the bytes.
-            # Here, image_data already holds the bytes.
-            
-            image_analysis = image_agent.analyze_image_from_bytes(image_data, user_prompt=user_input_text)
+            logger.info("Received image file: %s", image_filename)
+            # image_data was read once above and is shared by every call on this image.
+            # Gemini's safety filters are applied on this call; a blocked prompt is a guardrail block.
+            # The analysis and the user-facing reply come back from the same request.
+            is_input_safe, image_result = guardrail_agent.wrap_call(
+                "image", image_agent.analyze_and_respond, image_data, user_prompt=user_input_text,
+                history=llm_history, safety_settings=guardrail_agent.default_safety_settings, mime_type=image_mime_type
+            )
+            if not is_input_safe:
+                return blocked_input_response(user_entry, image_result)
+            image_analysis, final_response_text = image_result
             context_summary = f"Image analysis: {image_analysis}"
 
-            context_manager.add_message("user", f"[Image: {secure_filename(uploaded_file.filename)}] {user_input_text if user_input_text else 'Image provided.'}")
-            context_manager.add_message("model", f"[Image Analysis]: {image_analysis}")
-            gemini_response = f"[Image Analysis]: {image_analysis}"
+            gemini_response = IMAGE_ANALYSIS_PREFIX + image_analysis
+            pending_messages.append({'role': "user", 'content': f"[Image: {image_filename}] {user_input_text or 'Image provided.'}"})
+            pending_messages.append({'role': "model", 'content': gemini_response})
 
         elif user_input_text:
             # Process text input (only if safe)
-            logging.info(f"Received text input: '{user_input_text}'")
-            text_analysis = text_agent.analyze_text(user_input_text, history=llm_history)
+            logger.info("Received text input: '%s'", user_input_text)
+            if analysis_future is not None:
+                is_input_safe, text_result = analysis_future.result()
+            else:
+                is_input_safe, text_result = guardrail_agent.wrap_call(
+                    "text", text_agent.analyze_and_respond, user_input_text,
+                    history=llm_history, safety_settings=guardrail_agent.default_safety_settings
+                )
+            if not is_input_safe:
+                return blocked_input_response(user_entry, text_result)
+            text_analysis, reply, needs_action = text_result
+            if not needs_action:
+                # The reply drafted with the analysis is final; ResponseAgent is only needed around actions.
+                final_response_text = reply
             context_summary = f"Text analysis: {text_analysis}"
 
-            context_manager.add_message("user", user_input_text)
-            context_manager.add_message("model", f"[Text Analysis]: {text_analysis}")
-            gemini_response = f"[Text Analysis]: {text_analysis}"
-
-        # Determine if an action is needed based on the combined context
-        action_data = action_agent.determine_action(context_summary)
-        
-        # --- GUARDRAIL STEP 2: Action Validation ---
-        is_action_valid, action_validation_message = action_agent.validate_action(action_data)
-
-        if not is_action_valid:
-            # Action was blocked by guardrails
-            logging.warning(f"Action blocked by guardrail: {action_validation_message}")
-            action_message = f"[ACTION BLOCKED]: {action_validation_message}"
-        elif action_data["action"] != "none":
-            # Action is valid and needs to be executed
-            action_agent.execute_action(action_data)
-            action_message = f"[ACTION]: {action_data['action']} performed."
-            if 'query' in action_data:
-                action_message += f" (Query: '{action_data['query']}')"
-            elif 'details' in action_data:
-                action_message += f" (Details: '{action_data['details'][:50]}...')"
-            logging.info(action_message)
-        else:
-            action_message = "[ACTION]: No specific action determined."
-            logging.info(action_message)
-
-        # Generate final response to the user
-        final_response_text = response_agent.generate_response(context_summary, history=llm_history)
-        context_manager.add_message("model", final_response_text)
+            pending_messages.append({'role': "user", 'content': user_input_text})
+            gemini_response = TEXT_ANALYSIS_PREFIX + text_analysis
+            pending_messages.append({'role': "model", 'content': gemini_response})
+
+        # Determine, validate (GUARDRAIL STEP 2) and execute an action based on the combined context.
+        # A valid action runs in the background while the reply is generated (the reply doesn't
+        # depend on its outcome) and is awaited before returning.
+        action_message, action_future = action_agent.decide_and_execute(context_summary, submit=executor.submit)
+
+        if wants_stream:
+            header = SECTION_SEPARATOR.join((gemini_response, action_message, REPLY_PREFIX))
+            if final_response_text is None:
+                reply_chunks = response_agent.generate_response_stream(context_summary, history=llm_history)
+            else:
+                reply_chunks = [final_response_text]
+            # Saved now rather than from the generator: if the client disconnects, the server closes
+            # the generator (possibly before it has started), and only the reply should be lost.
+            context_manager.add_messages(pending_messages)
+            return Response(stream_with_context(stream_chat_response(header, reply_chunks, action_future)), mimetype='text/event-stream')
+
+        # Generate final response to the user (image turns and simple text turns already have one)
+        if final_response_text is None:
+            final_response_text = response_agent.generate_response(context_summary, history=llm_history)
+        if action_future is not None:
+            action_future.result()
+        pending_messages.append({'role': "model", 'content': final_response_text})
+        context_manager.add_messages(pending_messages)
 
         # Combine messages for the UI
-        full_response = f"{gemini_response}\n\n{action_message}\n\nGemini: {final_response_text}"
+        full_response = SECTION_SEPARATOR.join((gemini_response, action_message, REPLY_PREFIX + final_response_text))
 
         return jsonify({"response": full_response, "history": context_manager.get_full_history()})
 
     except Exception as e:
-        logging.exception("An error occurred during chat processing.")
+        logger.exception("An error occurred during chat processing.")
+        context_manager.add_messages(pending_messages) # Keep what the turn produced before failing
         return jsonify({"error": str(e)}), 500
 
 @app.route('/clear_history', methods=['POST'])
@@ -150,18 +254,29 @@ def clear_history():
         context_manager.clear_history()
         return jsonify({"message": "History cleared successfully."})
     except Exception as e:
-        logging.exception("Error clearing history.")
+        logger.exception("Error clearing history.")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/get_history', methods=['GET'])
 def get_history():
-    """Returns the current conversation history."""
-    return jsonify({"history": context_manager.get_full_history()})
+    """
+    Returns the current conversation history. Responses carry an ETag, so clients that poll
+    with If-None-Match get an empty 304 response while the history is unchanged.
+    """
+    response = jsonify({"history": context_manager.get_full_history()})
+    response.add_etag()
+    response.cache_control.no_cache = True # Browsers may reuse the response, but must revalidate first
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
-    if not os.path.exists(HISTORY_FILE):
-        with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f)
-    
-    app.run(debug=True)
+    try:
+        # An empty file is an empty JSON Lines history. 'x' creates it only if it doesn't exist yet.
+        with open(HISTORY_FILE, 'xb'):
+            pass
+    except FileExistsError:
+        pass
+
+    # Flask's development server; use gunicorn (see gunicorn_conf.py) in production.
+    # Set FLASK_DEBUG=1 for the debugger and reloader.
+    app.run()
 
@@ -17,6 +17,7 @@ document.addEventListener('DOMContentLoaded', () => {
      * @param {string} sender - 'user' or 'gemini'.
      * @param {string} message - The text message to display.
      * @param {string} [imageUrl=null] - Optional URL for an image to display.
+     * @returns {HTMLElement} The text element, so streamed messages can be updated in place.
      */
     function displayMessage(sender, message, imageUrl = null) {
         const messageBubble = document.createElement('div');
@@ -43,6 +44,38 @@ document.addEventListener('DOMContentLoaded', () => {
 
         chatHistoryDiv.appendChild(messageBubble);
         chatHistoryDiv.scrollTop = chatHistoryDiv.scrollHeight; // Scroll to bottom
+        return textElement;
+    }
+
+    /**
+     * Reads a server-sent event stream, calling onEvent with each event's parsed JSON data.
+     * @param {Response} response - A fetch response with a 'text/event-stream' body.
+     * @param {function(Object)} onEvent - Called once per event, in order.
+     */
+    async function readEventStream(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            // Events are separated by a blank line; keep any partial event for the next read.
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const event = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const data = event.split('\n')
+                    .filter(line => line.startsWith('data: '))
+                    .map(line => line.slice(6))
+                    .join('\n');
+                if (data) {
+                    onEvent(JSON.parse(data));
+                }
+            }
+        }
     }
 
     /**
@@ -78,7 +111,7 @@ document.addEventListener('DOMContentLoaded', () => {
             chatHistoryDiv.innerHTML = ''; // Clear existing history
             data.history.forEach(item => {
                 // For simplicity, we assume image content in history is just text analysis.
-                // If you want to display the original image, you'd need to store its URL/data in history.json
+                // If you want to display the original image, you'd need to store its URL/data in history.jsonl
                 // and handle it here. For now, we only display text content.
                 displayMessage(item.role, item.content);
             });
@@ -128,9 +161,11 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         try {
+            // Ask for a streamed reply; blocked inputs and errors still come back as JSON.
             const response = await fetch('/chat', {
                 method: 'POST',
                 body: formData,
+                headers: { 'Accept': 'text/event-stream' },
             });
 
             if (!response.ok) {
@@ -138,8 +173,24 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error(errorData.error || `HTTP error! status: ${response.status}`);
             }
 
-            const data = await response.json();
-            displayMessage('gemini', data.response); // Display Gemini's full response
+            if ((response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+                // Render Gemini's response as it arrives
+                const textElement = displayMessage('gemini', '');
+                let streamedText = '';
+                await readEventStream(response, (event) => {
+                    if (event.error) {
+                        throw new Error(event.error);
+                    }
+                    if (event.delta) {
+                        streamedText += event.delta;
+                        textElement.innerHTML = streamedText.replace(/\n/g, '<br>');
+                        chatHistoryDiv.scrollTop = chatHistoryDiv.scrollHeight;
+                    }
+                });
+            } else {
+                const data = await response.json();
+                displayMessage('gemini', data.response); // Display Gemini's full response
+            }
 
             // Clear inputs after sending
             textInput.value = '';